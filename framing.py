@@ -0,0 +1,122 @@
+import struct
+from typing import List, Tuple, Union
+
+# Wire format shared by client and server. Every datagram is
+#   <seq: uint32 LE><opcode: uint8><part: uint16 LE><parts: uint16 LE><field>*
+# where each field is a uint16 (network order) byte length followed by
+# that many UTF-8 bytes, so field contents may contain any character.
+# A response too large for one datagram is split on field boundaries into
+# `parts` datagrams sharing the request's seq; requests are always 0 of 1.
+
+# Request opcodes; responses echo the request's opcode on success
+CONNECT = 1
+LIST = 2
+SEND = 3
+RETRIEVE = 4
+
+# Response-only opcode; the single field is the error message
+ERROR = 255
+
+HEADER = struct.Struct("<IBHH")
+FIELD_LENGTH = struct.Struct("!H")
+ENCODING = 'utf-8'
+
+# Stay below a typical 1500-byte MTU so datagrams are never IP-fragmented
+MAX_DATAGRAM = 1400
+
+# Largest payload a single UDP/IPv4 datagram can carry; requests are never
+# split, so this bounds a request and sizes the server's receive buffers
+MAX_REQUEST = 65507
+
+# Upper bounds on one response: datagrams, and bytes across all of them.
+# The whole burst has to fit in the client's receive buffer, and the server
+# keeps it for replays. A single field larger than MAX_RESPONSE is still
+# sent on its own, so no response exceeds MAX_RESPONSE or one MAX_REQUEST
+MAX_PARTS = 32
+MAX_RESPONSE = MAX_PARTS * MAX_DATAGRAM
+
+
+def encode_field(field: str) -> bytes:
+    """Length-prefix a single string field"""
+    data = field.encode(ENCODING)
+    return FIELD_LENGTH.pack(len(data)) + data
+
+
+def pack(seq: int, opcode: int, *fields: str) -> bytes:
+    """Build a single datagram from a sequence number, opcode and fields"""
+    return HEADER.pack(seq, opcode, 0, 1) + b"".join(map(encode_field, fields))
+
+
+def pack_parts(seq: int, opcode: int, fields: List[str]) -> List[bytes]:
+    """Coalesce fields into as few datagrams as fit in MAX_DATAGRAM
+
+    A field that is larger on its own still gets a datagram to itself.
+    """
+    chunks: List[List[bytes]] = [[]]
+    size = HEADER.size
+    for field in fields:
+        record = encode_field(field)
+        if chunks[-1] and size + len(record) > MAX_DATAGRAM:
+            chunks.append([])
+            size = HEADER.size
+        chunks[-1].append(record)
+        size += len(record)
+
+    parts = len(chunks)
+    return [HEADER.pack(seq, opcode, part, parts) + b"".join(chunk)
+            for part, chunk in enumerate(chunks)]
+
+
+def fitting_fields(fields: List[str], min_fields: int = 1) -> int:
+    """Return how many leading fields pack_parts fits in one response
+
+    The response is bounded by MAX_PARTS datagrams and MAX_RESPONSE bytes,
+    but the first min_fields always count, so an oversized field still
+    goes out by itself.
+    """
+    parts = 1
+    size = total = HEADER.size
+    for count, field in enumerate(fields):
+        record_size = FIELD_LENGTH.size + len(field.encode(ENCODING))
+        if size > HEADER.size and size + record_size > MAX_DATAGRAM:
+            parts += 1
+            size = HEADER.size
+            total += HEADER.size
+        size += record_size
+        total += record_size
+        if count >= min_fields and (parts > MAX_PARTS or total > MAX_RESPONSE):
+            return count
+    return len(fields)
+
+
+def unpack_header(data: Union[bytes, memoryview]) -> Tuple[int, int, int, int]:
+    """Read a datagram's seq, opcode, part and part count without its fields"""
+    if len(data) < HEADER.size:
+        raise ValueError("Datagram shorter than header")
+
+    seq, opcode, part, parts = HEADER.unpack_from(data)
+    if part >= parts:
+        raise ValueError("Part index out of range")
+    return seq, opcode, part, parts
+
+
+def unpack_fields(data: Union[bytes, memoryview]) -> List[str]:
+    """Decode the string fields that follow a datagram's header"""
+    fields = []
+    offset = HEADER.size
+    end = len(data)
+    while offset < end:
+        if offset + FIELD_LENGTH.size > end:
+            raise ValueError("Truncated field")
+        length, = FIELD_LENGTH.unpack_from(data, offset)
+        offset += FIELD_LENGTH.size
+        if offset + length > end:
+            raise ValueError("Truncated field")
+        fields.append(str(data[offset:offset + length], ENCODING))
+        offset += length
+    return fields
+
+
+def unpack(data: Union[bytes, memoryview]) -> Tuple[int, int, int, int, List[str]]:
+    """Split a datagram into its seq, opcode, part, part count and fields"""
+    return (*unpack_header(data), unpack_fields(data))
@@ -1,20 +1,42 @@
-from socket import *
-from typing import Dict, Optional, List, Union
+from typing import Dict, Optional, List, Tuple, Union
+import asyncio
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from dataclasses import dataclass
 import json
 from datetime import datetime
 import time
-
-# Configure logging
+import random
+import struct
+
+import framing
+
+# Configure logging. Records are queued on the calling thread and written
+# to the file and console by a background listener thread
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('client.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('client.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger(__name__)
+
+
+# ServerResponse.error_kind values: the server never answered (worth
+# retrying after a pause) vs. the server answered with an ERROR (retrying
+# the same request will fail the same way)
+ERROR_TIMEOUT = "TIMEOUT"
+ERROR_SERVER = "SERVER"
 
 
 @dataclass
@@ -24,122 +46,181 @@ class ServerResponse:
     data: Optional[Union[str, List[str], Dict]]
     error: Optional[str] = None
     address: Optional[tuple] = None
+    error_kind: Optional[str] = None
+
+
+class ChatDatagramProtocol(asyncio.DatagramProtocol):
+    """Routes response datagrams to the request waiting on their seq"""
+
+    __slots__ = ('transport', 'pending')
+
+    def __init__(self):
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        # seq -> (future for the full reply, response parts received so far)
+        self.pending: Dict[int, Tuple[asyncio.Future, Dict[int, List[str]]]] = {}
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        try:
+            seq, opcode, part, parts, fields = framing.unpack(data)
+        except ValueError:
+            return
+
+        # No waiter means a late reply to a request that already finished
+        if seq not in self.pending:
+            return
+        future, received = self.pending[seq]
+        received[part] = fields
+        if len(received) == parts and not future.done():
+            future.set_result(
+                (opcode, [field for part in range(parts) for field in received[part]]))
+
+    def error_received(self, exc: Exception) -> None:
+        # e.g. ICMP port unreachable while the server is down; the waiting
+        # request simply times out and retries
+        logger.error(f"Error sending message: {str(exc)}")
 
 
 class ChatProtocol:
+    # Fixed attribute set: slot access is cheaper than an instance __dict__
+    __slots__ = ('server_host', 'server_port', 'timeout', 'deadline',
+                 'transport', 'datagram_protocol', 'server_address',
+                 'username', 'seq')
+
     def __init__(self, server_host: str = 'localhost', server_port: int = 12000):
         self.server_host = server_host
         self.server_port = server_port
-        self.buffer_size = 2048
-        self.encoding = 'utf-8'
-        self.max_retries = 3
-        self.timeout = 5.0
-        self.socket: Optional[socket] = None
+        self.timeout = 0.05  # first attempt; doubles on every retry
+        self.deadline = 2.0  # total seconds allowed per request
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.datagram_protocol: Optional[ChatDatagramProtocol] = None
+        self.server_address: Optional[tuple] = None
         self.username: Optional[str] = None
+        # Random start, so a restarted client reusing a source port does not
+        # hit replies the server cached for its previous run
+        self.seq = random.getrandbits(32)
 
-    def initialize_socket(self) -> None:
-        """Initialize UDP socket with timeout"""
+    async def initialize_socket(self) -> None:
+        """Open a UDP endpoint connected to the server"""
         try:
-            self.socket = socket(AF_INET, SOCK_DGRAM)
-            self.socket.settimeout(self.timeout)
+            # remote_addr connect()s the socket, so sends skip the per-call
+            # address and the kernel drops datagrams from any other source
+            loop = asyncio.get_running_loop()
+            self.transport, self.datagram_protocol = await loop.create_datagram_endpoint(
+                ChatDatagramProtocol,
+                remote_addr=(self.server_host, self.server_port))
+            self.server_address = self.transport.get_extra_info('peername')
         except Exception as e:
-            logging.error(f"Failed to initialize socket: {str(e)}")
+            logger.error(f"Failed to initialize socket: {str(e)}")
             raise
 
-    def send_with_retry(self, message: str) -> ServerResponse:
-        """Send message to server with retry mechanism"""
-        if not self.socket:
-            self.initialize_socket()
+    async def send_with_retry(self, opcode: int, *fields: str) -> ServerResponse:
+        """Send request to server with retry mechanism
 
-        for attempt in range(self.max_retries):
-            try:
-                self.socket.sendto(message.encode(self.encoding),
-                                   (self.server_host, self.server_port))
-
-                # Wait for acknowledgment
-                response, server_address = self.socket.recvfrom(
-                    self.buffer_size)
-                response_text = response.decode(self.encoding)
-
-                if response_text == "ACK":
-                    # Wait for actual response after ACK
-                    response, server_address = self.socket.recvfrom(
-                        self.buffer_size)
-                    response_text = response.decode(self.encoding)
-
-                    # Send acknowledgment back
-                    self.socket.sendto("ACK".encode(
-                        self.encoding), server_address)
-
-                    if response_text.startswith("ERROR"):
-                        _, error_message = response_text.split("|", 1)
-                        return ServerResponse(False, None, error_message, server_address)
-
-                    return ServerResponse(True, response_text, None, server_address)
-
-            except timeout:
-                logging.warning(
-                    f"Attempt {attempt + 1} timed out, retrying...")
-                time.sleep(min(2 ** attempt, 10))  # Exponential backoff
-            except Exception as e:
-                logging.error(f"Error sending message: {str(e)}")
+        Several requests may be in flight at once; each waits only for the
+        datagrams carrying its own sequence number.
+        """
+        if not self.transport:
+            await self.initialize_socket()
 
-        return ServerResponse(False, None, "Failed to communicate with server after retries")
+        # Retries resend the same sequence number so the server can replay
+        # its stored response instead of handling the request twice
+        self.seq = seq = (self.seq + 1) & 0xFFFFFFFF
+        try:
+            request = framing.pack(seq, opcode, *fields)
+        except struct.error:
+            # A single field longer than its uint16 length prefix allows
+            request = None
+        if request is None or len(request) > framing.MAX_REQUEST:
+            # Not transient, so no error_kind: retrying would fail the same way
+            return ServerResponse(False, None, "Request too large to send")
+        future = asyncio.get_running_loop().create_future()
+        self.datagram_protocol.pending[seq] = (future, {})
+
+        # Hoisted out of the retry loop
+        transport = self.transport
+        timeout = self.timeout
+        monotonic = time.monotonic
 
-    def connect(self, username: str, first_name: str) -> ServerResponse:
+        try:
+            deadline = monotonic() + self.deadline
+            attempt = 0
+            while True:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    transport.sendto(request)
+                    # shield: a timed-out attempt must not cancel the reply
+                    # future that the next attempt keeps waiting on
+                    reply_opcode, reply_fields = await asyncio.wait_for(
+                        asyncio.shield(future),
+                        max(timeout, min(timeout * 2 ** attempt, remaining)))
+
+                    if reply_opcode == framing.ERROR:
+                        return ServerResponse(False, None, reply_fields[0], self.server_address,
+                                              ERROR_SERVER)
+
+                    return ServerResponse(True, reply_fields, None, self.server_address)
+
+                except asyncio.TimeoutError:
+                    logger.warning(
+                        f"Attempt {attempt + 1} timed out, retrying...")
+                except Exception as e:
+                    logger.error(f"Error sending message: {str(e)}")
+
+                # Short exponential backoff with +/-50% jitter so clients that
+                # lost packets together do not retry in lockstep
+                backoff = min(0.005 * 2 ** attempt, 0.5) * (0.5 + random.random())
+                await asyncio.sleep(max(0.0, min(backoff, deadline - monotonic())))
+                attempt += 1
+        finally:
+            del self.datagram_protocol.pending[seq]
+            future.cancel()
+
+        return ServerResponse(False, None, "Failed to communicate with server after retries",
+                              error_kind=ERROR_TIMEOUT)
+
+    async def connect(self, username: str, first_name: str) -> ServerResponse:
         """Connect to the chat server"""
         self.username = username
-        message = f"CONNECT|{username}|{first_name}"
-        response = self.send_with_retry(message)
+        response = await self.send_with_retry(framing.CONNECT, username, first_name)
 
         if response.success and response.data:
-            logging.info(f"Successfully connected user: {username}")
+            logger.info(f"Successfully connected user: {username}")
             self._save_session(username)
         return response
 
-    def list_users(self) -> ServerResponse:
+    async def list_users(self) -> ServerResponse:
         """Get list of online users"""
         if not self.username:
             return ServerResponse(False, None, "Not connected to server")
 
-        message = f"LIST|{self.username}"
-        response = self.send_with_retry(message)
-
-        if response.success and response.data:
-            try:
-                # Parse the LIST response
-                _, *users = response.data.split("|")
-                return ServerResponse(True, users, None, response.address)
-            except Exception as e:
-                logging.error(f"Error parsing user list: {str(e)}")
-                return ServerResponse(False, None, "Failed to parse user list")
-        return response
+        return await self.send_with_retry(framing.LIST, self.username)
 
-    def send_message(self, recipient: str, content: str) -> ServerResponse:
+    async def send_message(self, recipient: str, content: str) -> ServerResponse:
         """Send message to specific user"""
         if not self.username:
             return ServerResponse(False, None, "Not connected to server")
 
-        message = f"SEND|{self.username}|{recipient}|{content}"
-        return self.send_with_retry(message)
+        return await self.send_with_retry(framing.SEND, self.username, recipient, content)
 
-    def retrieve_messages(self, from_user: str) -> ServerResponse:
+    async def retrieve_messages(self, from_user: str) -> ServerResponse:
         """Retrieve messages from specific user"""
         if not self.username:
             return ServerResponse(False, None, "Not connected to server")
 
-        message = f"RETRIEVE|{from_user}|{self.username}"
-        response = self.send_with_retry(message)
+        response = await self.send_with_retry(framing.RETRIEVE, from_user, self.username)
 
         if response.success and response.data:
             try:
                 # Parse the RETRIEVE response
-                parts = response.data.split("|")
-                if len(parts) >= 4:
-                    _, to_user, from_user, count, *messages = parts
-                    return ServerResponse(True, messages, None, response.address)
+                to_user, from_user, count, *messages = response.data
+                return ServerResponse(True, messages, None, response.address)
             except Exception as e:
-                logging.error(f"Error parsing retrieved messages: {str(e)}")
+                logger.error(f"Error parsing retrieved messages: {str(e)}")
                 return ServerResponse(False, None, "Failed to parse messages")
         return response
 
@@ -154,12 +235,12 @@ class ChatProtocol:
             with open(f"{username}_session.json", "w") as f:
                 json.dump(session_data, f)
         except Exception as e:
-            logging.warning(f"Failed to save session: {str(e)}")
+            logger.warning(f"Failed to save session: {str(e)}")
 
     def close(self) -> None:
         """Clean up resources"""
-        if self.socket:
+        if self.transport:
             try:
-                self.socket.close()
+                self.transport.close()
             except Exception as e:
-                logging.error(f"Error closing socket: {str(e)}")
+                logger.error(f"Error closing socket: {str(e)}")
@@ -1,11 +1,44 @@
-from protocol import ChatProtocol
+from protocol import ChatProtocol, ERROR_TIMEOUT
+import asyncio
 import logging
 import sys
-from typing import Optional
+import threading
+from typing import Any, Callable, List, Optional
 import signal
 import time
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+
+async def run_blocking(func: Callable, *args) -> Any:
+    """Run a blocking call such as input() without stalling the event loop
+
+    Uses a daemon thread rather than the default executor, whose worker
+    threads are joined at exit and would keep a shutdown waiting on stdin.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(setter, value) -> None:
+        if not future.done():
+            setter(value)
+
+    def worker() -> None:
+        try:
+            result = func(*args)
+        except BaseException as e:
+            setter, value = future.set_exception, e
+        else:
+            setter, value = future.set_result, result
+        try:
+            loop.call_soon_threadsafe(resolve, setter, value)
+        except RuntimeError:
+            pass  # Event loop already closed during shutdown
+
+    threading.Thread(target=worker, daemon=True).start()
+    return await future
+
 
 class ChatClient:
     def __init__(self):
@@ -34,26 +67,25 @@ class ChatClient:
         print("4. Exit")
         print("====================================")
 
-    def handle_user_list(self) -> None:
+    async def handle_user_list(self) -> None:
         """Handle listing online users"""
-        response = self.protocol.list_users()
-        if response.success and response.data:
+        response = await self.protocol.list_users()
+        if response.success and not response.data:
+            print("\nCurrently No Other Users Registered")
+        elif response.success:
             print("\nOnline Users:")
             for user in response.data:
-                username, status, online = user.split("-")
+                # Entries are "<username>-Online-<bool>"; split from the
+                # right so usernames containing '-' stay intact
+                username, status, online = user.rsplit("-", 2)
                 status_icon = "🟢" if online.lower() == "true" else "⚪"
                 print(f"{status_icon} {username}")
         else:
             print(f"Error: {response.error or 'Failed to retrieve user list'}")
 
-    def handle_send_message(self) -> None:
-        """Handle sending a message"""
-        recipient = input("Enter recipient username: ").strip()
-        if not recipient:
-            print("Invalid recipient username")
-            return
-
-        print("Enter your message (press Ctrl+D or Ctrl+Z to finish):")
+    @staticmethod
+    def read_message_lines() -> List[str]:
+        """Read message lines from stdin until EOF"""
         message_lines = []
         try:
             while True:
@@ -61,16 +93,27 @@ class ChatClient:
                 message_lines.append(line)
         except (EOFError, KeyboardInterrupt):
             pass
+        return message_lines
+
+    async def handle_send_message(self) -> None:
+        """Handle sending a message"""
+        recipient = (await run_blocking(input, "Enter recipient username: ")).strip()
+        if not recipient:
+            print("Invalid recipient username")
+            return
+
+        print("Enter your message (press Ctrl+D or Ctrl+Z to finish):")
+        message_lines = await run_blocking(self.read_message_lines)
 
         message = "\n".join(message_lines)
         if message.strip():
-            response = self.protocol.send_message(recipient, message)
+            response = await self.protocol.send_message(recipient, message)
             if response.success:
                 print("Message sent successfully!")
             else:
                 print(f"Failed to send message: {response.error}")
 
-    def handle_check_messages(self) -> None:
+    async def handle_check_messages(self) -> None:
         """Handle checking messages"""
         print("\n======= Messages =======")
         print("1. Retrieve Messages")
@@ -78,18 +121,18 @@ class ChatClient:
         print("=======================")
 
         try:
-            choice = int(input("Choose an option: "))
+            choice = int(await run_blocking(input, "Choose an option: "))
             if choice == 1:
-                sender = input("Enter sender's username: ").strip()
+                sender = (await run_blocking(input, "Enter sender's username: ")).strip()
                 if sender:
-                    response = self.protocol.retrieve_messages(sender)
+                    response = await self.protocol.retrieve_messages(sender)
                     if response.success and response.data:
-                        print(f"\nMessages from {sender}:")
-                        for idx, msg in enumerate(response.data, 1):
-                            print(f"\n--- Message {idx} ---")
-                            print(
-                                f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-                            print(f"Content: {msg}")
+                        # Format once and write all messages in one call
+                        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                        sys.stdout.write(f"\nMessages from {sender}:\n" + "".join(
+                            f"\n--- Message {idx} ---\nTime: {now}\nContent: {msg}\n"
+                            for idx, msg in enumerate(response.data, 1)))
+                        sys.stdout.flush()
                     else:
                         print(
                             "No new messages" if not response.error else f"Error: {response.error}")
@@ -98,22 +141,32 @@ class ChatClient:
         except ValueError:
             print("Invalid input. Please enter a number.")
 
-    def connect(self) -> bool:
+    @staticmethod
+    async def pause(budget: float, delay: float = 1.0) -> float:
+        """Sleep for up to delay seconds of the budget; return what is left"""
+        start = time.monotonic()
+        await asyncio.sleep(min(delay, budget))
+        return max(0.0, budget - (time.monotonic() - start))
+
+    async def connect(self) -> bool:
         """Handle user connection"""
         max_attempts = 3
+        # Total pause allowed between attempts; each request already
+        # retries on its own deadline inside the protocol
+        pause_budget = 2.0
         for attempt in range(max_attempts):
             try:
-                username = input("Enter username: ").strip()
+                username = (await run_blocking(input, "Enter username: ")).strip()
                 if not username:
                     print("Username cannot be empty")
                     continue
 
-                first_name = input("Enter your first name: ").strip()
+                first_name = (await run_blocking(input, "Enter your first name: ")).strip()
                 if not first_name:
                     print("First name cannot be empty")
                     continue
 
-                response = self.protocol.connect(username, first_name)
+                response = await self.protocol.connect(username, first_name)
                 if response.success:
                     print(
                         f"Welcome {first_name}! You are now connected to PyChat.")
@@ -122,34 +175,37 @@ class ChatClient:
                     print(f"Connection failed: {response.error}")
                     if attempt < max_attempts - 1:
                         print(f"Retrying... ({attempt + 1}/{max_attempts})")
-                        time.sleep(1)
+                        # Only back off when the server could not be
+                        # reached; a rejected request is re-prompted at once
+                        if response.error_kind == ERROR_TIMEOUT:
+                            pause_budget = await self.pause(pause_budget)
             except Exception as e:
-                logging.error(f"Error during connection: {str(e)}")
+                logger.error(f"Error during connection: {str(e)}")
                 if attempt < max_attempts - 1:
                     print("An error occurred. Retrying...")
-                    time.sleep(1)
+                    pause_budget = await self.pause(pause_budget)
 
         print("Failed to connect after multiple attempts")
         return False
 
-    def run(self) -> None:
+    async def run(self) -> None:
         """Main client loop"""
         print("============Welcome To PyChat=============")
 
-        if not self.connect():
+        if not await self.connect():
             return
 
         while self.running:
             try:
                 self.display_menu()
-                choice = input("Enter your choice (1-4): ").strip()
+                choice = (await run_blocking(input, "Enter your choice (1-4): ")).strip()
 
                 if choice == "1":
-                    self.handle_user_list()
+                    await self.handle_user_list()
                 elif choice == "2":
-                    self.handle_send_message()
+                    await self.handle_send_message()
                 elif choice == "3":
-                    self.handle_check_messages()
+                    await self.handle_check_messages()
                 elif choice == "4":
                     print("Thank you for using PyChat!")
                     self.handle_shutdown(None, None)
@@ -157,10 +213,10 @@ class ChatClient:
                     print("Invalid option. Please try again.")
 
             except Exception as e:
-                logging.error(f"Error in main loop: {str(e)}")
+                logger.error(f"Error in main loop: {str(e)}")
                 print("An error occurred. Please try again.")
 
 
 if __name__ == "__main__":
     client = ChatClient()
-    client.run()
+    asyncio.run(client.run())
@@ -1,225 +1,411 @@
 from socket import *
+import atexit
 import json
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import os
+import selectors
+import sqlite3
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import List, Optional, Tuple
 
-# Configure logging
+import framing
+
+# Configure logging. Records are queued on the calling thread and written
+# to the file and console by a background listener thread
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    logging.FileHandler('server.log'),
+    logging.StreamHandler()
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('server.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
+
+logger = logging.getLogger(__name__)
 
 
 class ChatServer:
-    def __init__(self, port: int = 12000, buffer_size: int = 2048):
+    # Fixed attribute set: slot access is cheaper than an instance __dict__
+    __slots__ = ('port', 'buffer_size', 'db', 'user_list_cache', 'socket',
+                 'selector', 'replay_cache', 'BATCH_SIZE', 'REPLAY_CACHE_SIZE',
+                 'DB_FILE', 'USERS_FILE', 'MESSAGES_FILE', 'WAL_FILE',
+                 'recv_buffers')
+
+    def __init__(self, port: int = 12000, buffer_size: int = framing.MAX_REQUEST):
         self.port = port
         self.buffer_size = buffer_size
-        self.users: List[Dict] = []
-        self.messages: List[Dict] = []
+        self.db: Optional[sqlite3.Connection] = None
+        # Formatted LIST entries as (address, entry); None when stale
+        self.user_list_cache: Optional[List[Tuple[tuple, str]]] = None
         self.socket: Optional[socket] = None
+        self.selector: Optional[selectors.BaseSelector] = None
+        # Last response per (address, seq), replayed on retransmitted requests
+        self.replay_cache: OrderedDict = OrderedDict()
 
         # Constants
-        self.ENCODING = 'utf-8'
-        self.MAX_RETRIES = 3
-        self.TIMEOUT = 5.0  # seconds
+        self.BATCH_SIZE = 64  # max datagrams drained per wakeup
+        self.REPLAY_CACHE_SIZE = 1024
+        self.DB_FILE = "chat.db"
+        # Storage used before SQLite, imported once into an empty database
+        self.USERS_FILE = "users.txt"
+        self.MESSAGES_FILE = "messages.txt"
+        self.WAL_FILE = "messages.wal"
+
+        # One reusable receive buffer per batch slot
+        self.recv_buffers = [memoryview(bytearray(self.buffer_size))
+                             for _ in range(self.BATCH_SIZE)]
 
     def initialize_socket(self) -> None:
-        """Initialize and bind the UDP socket with timeout"""
+        """Initialize and bind a non-blocking UDP socket to a selector"""
         try:
             self.socket = socket(AF_INET, SOCK_DGRAM)
             self.socket.bind(('', self.port))
-            self.socket.settimeout(self.TIMEOUT)
-            logging.info(f"Server initialized on port {self.port}")
+            self.socket.setblocking(False)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.socket, selectors.EVENT_READ)
+            logger.info(f"Server initialized on port {self.port}")
         except Exception as e:
-            logging.error(f"Failed to initialize socket: {str(e)}")
+            logger.error(f"Failed to initialize socket: {str(e)}")
             raise
 
     def load_data(self) -> None:
-        """Load users and messages from files with error handling"""
+        """Open the SQLite database, creating the schema if needed"""
         try:
-            with open("users.txt", "r") as f:
-                self.users = json.load(f)
-        except FileNotFoundError:
-            logging.warning(
-                "Users file not found. Starting with empty users list.")
-        except json.JSONDecodeError:
-            logging.error(
-                "Users file corrupted. Starting with empty users list.")
+            # Autocommit: every statement is durable on its own and the
+            # WAL journal keeps each write to an append
+            self.db = sqlite3.connect(self.DB_FILE, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    first_name TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    port INTEGER NOT NULL,
+                    online INTEGER NOT NULL DEFAULT 0,
+                    is_chatting INTEGER NOT NULL DEFAULT 0,
+                    last_seen TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    from_user TEXT NOT NULL,
+                    to_user TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    retrieved INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS messages_unread
+                    ON messages (from_user, to_user) WHERE retrieved = 0;
+            """)
+            logger.info(f"Opened database {self.DB_FILE}")
+
+            # user_version 1 records that the old storage files were already
+            # considered, so they are imported at most once. A database that
+            # predates the marker but holds data is just marked
+            version, = self.db.execute("PRAGMA user_version").fetchone()
+            if version < 1:
+                empty = not self.db.execute(
+                    "SELECT EXISTS (SELECT 1 FROM users) "
+                    "OR EXISTS (SELECT 1 FROM messages)").fetchone()[0]
+                if empty:
+                    self.import_legacy_data()
+                self.db.execute("PRAGMA user_version = 1")
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open database: {str(e)}")
+            raise
+
+    def import_legacy_data(self) -> None:
+        """Copy the JSON snapshot and WAL of the old storage into the database
 
+        Message n of the old list becomes row id n + 1, so a WAL send event
+        already covered by the snapshot is skipped by its id.
+        """
+        wal_files = [path for path in (self.WAL_FILE + ".old", self.WAL_FILE)
+                     if os.path.exists(path)]
+        found = [path for path in (self.USERS_FILE, self.MESSAGES_FILE)
+                 if os.path.exists(path)] + wal_files
+        if not found:
+            return
+
+        def load_snapshot(path: str) -> list:
+            try:
+                with open(path, "r") as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return []
+            except json.JSONDecodeError:
+                logger.error(f"{path} is corrupted and was not imported")
+                return []
+
+        def upsert_user(user: dict) -> None:
+            host, port = user["address"]
+            self.db.execute(
+                "INSERT OR REPLACE INTO users (username, first_name, host, port, "
+                "online, is_chatting, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user["username"], user["firstName"], host, port,
+                 bool(user.get("online")), bool(user.get("isChatting")),
+                 user.get("last_seen", "")))
+
+        def add_message(n: int, msg: dict) -> None:
+            self.db.execute(
+                "INSERT OR IGNORE INTO messages (id, from_user, to_user, content, "
+                "timestamp, retrieved) VALUES (?, ?, ?, ?, ?, ?)",
+                (n + 1, msg["from"], msg["to"], msg["content"],
+                 msg.get("timestamp", ""), bool(msg.get("retrieved"))))
+
+        # One transaction: a failed import leaves the database empty and
+        # unmarked, so the next start tries again
+        self.db.execute("BEGIN")
         try:
-            with open("messages.txt", "r") as f:
-                self.messages = json.load(f)
-        except FileNotFoundError:
-            logging.warning(
-                "Messages file not found. Starting with empty messages list.")
-        except json.JSONDecodeError:
-            logging.error(
-                "Messages file corrupted. Starting with empty messages list.")
-
-    def save_data(self) -> None:
-        """Save current state to files"""
+            for user in load_snapshot(self.USERS_FILE):
+                upsert_user(user)
+            for n, msg in enumerate(load_snapshot(self.MESSAGES_FILE)):
+                add_message(n, msg)
+
+            # A crash mid-snapshot can leave the rotated log behind
+            for path in wal_files:
+                with open(path, "r") as f:
+                    for line in f:
+                        try:
+                            event = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Torn final line from a crash mid-write
+                            logger.warning(f"Skipping corrupt WAL entry in {path}")
+                            continue
+
+                        if event["op"] == "user":
+                            upsert_user(event["user"])
+                        elif event["op"] == "send":
+                            add_message(event["n"], event["msg"])
+                        elif event["op"] == "retrieve":
+                            self.db.execute(
+                                "UPDATE messages SET retrieved = 1 WHERE "
+                                "from_user = ? AND to_user = ? AND retrieved = 0",
+                                (event["from"], event["to"]))
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            logger.error(f"Failed to import {', '.join(found)}")
+            raise
+
+        users, = self.db.execute("SELECT COUNT(*) FROM users").fetchone()
+        messages, = self.db.execute("SELECT COUNT(*) FROM messages").fetchone()
+        logger.warning(
+            f"Imported {users} users and {messages} messages from "
+            f"{', '.join(found)} into {self.DB_FILE}; those files are no "
+            f"longer read and can be removed")
+
+    def send_response(self, response: Tuple[int, List[str]], seq: int,
+                      address: tuple) -> None:
+        """Send a response tagged with the request's sequence number"""
+        opcode, fields = response
+        datagrams = framing.pack_parts(seq, opcode, fields)
         try:
-            with open("users.txt", "w") as f:
-                json.dump(self.users, f, indent=2)
-            with open("messages.txt", "w") as f:
-                json.dump(self.messages, f, indent=2)
+            if self.socket:
+                for data in datagrams:
+                    self.socket.sendto(data, address)
         except Exception as e:
-            logging.error(f"Failed to save data: {str(e)}")
+            logger.error(f"Error sending message: {str(e)}")
 
-    def send_with_ack(self, message: str, address: tuple) -> bool:
-        """Send message with acknowledgment mechanism"""
-        for attempt in range(self.MAX_RETRIES):
-            try:
-                if self.socket:
-                    self.socket.sendto(message.encode(self.ENCODING), address)
-                    # Wait for acknowledgment
-                    ack, _ = self.socket.recvfrom(self.buffer_size)
-                    if ack.decode(self.ENCODING) == "ACK":
-                        return True
-            except timeout:
-                logging.warning(
-                    f"Attempt {attempt + 1} timed out, retrying...")
-            except Exception as e:
-                logging.error(f"Error sending message: {str(e)}")
-        return False
+        self.replay_cache[(address, seq)] = datagrams
+        if len(self.replay_cache) > self.REPLAY_CACHE_SIZE:
+            self.replay_cache.popitem(last=False)
+
+    def receive_batch(self) -> List[Tuple[memoryview, tuple]]:
+        """Drain up to BATCH_SIZE datagrams that are already queued
 
-    def handle_connect(self, message: str, address: tuple) -> None:
+        The returned views point into the reusable receive buffers and are
+        only valid until the next call.
+        """
+        batch = []
+        recvfrom_into = self.socket.recvfrom_into
+        try:
+            for buffer in self.recv_buffers:
+                nbytes, address = recvfrom_into(buffer)
+                batch.append((buffer[:nbytes], address))
+        except BlockingIOError:
+            pass
+        return batch
+
+    def handle_connect(self, fields: List[str], address: tuple,
+                       now: str) -> Tuple[int, List[str]]:
         """Handle CONNECT command"""
         try:
-            _, username, firstname = [part.strip()
-                                      for part in message.split("|")]
-
-            user = next(
-                (u for u in self.users if u["username"] == username), None)
-            if user:
-                user.update({
-                    "address": address,
-                    "online": True,
-                    "last_seen": datetime.now().isoformat()
-                })
-            else:
-                self.users.append({
-                    "username": username,
-                    "firstName": firstname,
-                    "address": address,
-                    "online": True,
-                    "isChatting": False,
-                    "last_seen": datetime.now().isoformat()
-                })
-
-            response = f"CONNECT|{username}|{firstname}|True"
-            self.send_with_ack(response, address)
-            self.save_data()
-            logging.info(f"User {username} connected successfully")
+            username, firstname = fields
+            host, port = address
+            self.db.execute(
+                "INSERT INTO users (username, first_name, host, port, online, last_seen) "
+                "VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (username) DO UPDATE SET "
+                "host = excluded.host, port = excluded.port, "
+                "online = 1, last_seen = excluded.last_seen",
+                (username, firstname, host, port, now))
+            self.user_list_cache = None
+            logger.info(f"User {username} connected successfully")
+            return framing.CONNECT, [username, firstname]
 
         except Exception as e:
-            logging.error(f"Error handling connect: {str(e)}")
-            self.send_with_ack("ERROR|Connection failed", address)
+            logger.error(f"Error handling connect: {str(e)}")
+            return framing.ERROR, ["Connection failed"]
 
-    def handle_list(self, address: tuple) -> None:
+    def handle_list(self, fields: List[str], address: tuple,
+                    now: str) -> Tuple[int, List[str]]:
         """Handle LIST command"""
         try:
-            online_users = [f"{u['username']}-Online-{u['online']}"
-                            for u in self.users if u['address'] != address]
-
-            response = "LIST|" + \
-                "|".join(
-                    online_users) if online_users else "LIST|Currently No Other Users Registered"
-            self.send_with_ack(response, address)
+            # Only rebuilt after a user record changes
+            if self.user_list_cache is None:
+                self.user_list_cache = [
+                    ((host, port), f"{username}-Online-{bool(online)}")
+                    for username, online, host, port in self.db.execute(
+                        "SELECT username, online, host, port FROM users "
+                        "ORDER BY rowid")]
+
+            online_users = [entry for user_address, entry in self.user_list_cache
+                            if user_address != address]
+            # Keep the response within framing.MAX_PARTS and MAX_RESPONSE
+            return framing.LIST, online_users[:framing.fitting_fields(online_users)]
 
         except Exception as e:
-            logging.error(f"Error handling list: {str(e)}")
-            self.send_with_ack("ERROR|Failed to retrieve user list", address)
+            logger.error(f"Error handling list: {str(e)}")
+            return framing.ERROR, ["Failed to retrieve user list"]
 
-    def handle_send(self, message: str, address: tuple) -> None:
+    def handle_send(self, fields: List[str], address: tuple,
+                    now: str) -> Tuple[int, List[str]]:
         """Handle SEND command"""
         try:
-            _, from_user, to_user, content = [
-                part.strip() for part in message.split("|")]
-
-            self.messages.append({
-                "from": from_user,
-                "to": to_user,
-                "content": content,
-                "timestamp": datetime.now().isoformat(),
-                "retrieved": False
-            })
+            from_user, to_user, content = fields
 
-            self.save_data()
-            self.send_with_ack("SUCCESS|Message sent", address)
-            logging.info(f"Message sent from {from_user} to {to_user}")
+            self.db.execute(
+                "INSERT INTO messages (from_user, to_user, content, timestamp) "
+                "VALUES (?, ?, ?, ?)",
+                (from_user, to_user, content, now))
+            logger.info(f"Message sent from {from_user} to {to_user}")
+            return framing.SEND, ["Message sent"]
 
         except Exception as e:
-            logging.error(f"Error handling send: {str(e)}")
-            self.send_with_ack("ERROR|Failed to send message", address)
+            logger.error(f"Error handling send: {str(e)}")
+            return framing.ERROR, ["Failed to send message"]
 
-    def handle_retrieve(self, message: str, address: tuple) -> None:
+    def handle_retrieve(self, fields: List[str], address: tuple,
+                        now: str) -> Tuple[int, List[str]]:
         """Handle RETRIEVE command"""
         try:
-            _, from_user, to_user = [part.strip()
-                                     for part in message.split("|")]
-
-            unretrieved_messages = [
-                msg["content"] for msg in self.messages
-                if msg["from"] == from_user and msg["to"] == to_user and not msg["retrieved"]
-            ]
-
-            # Mark messages as retrieved
-            for msg in self.messages:
-                if msg["from"] == from_user and msg["to"] == to_user:
-                    msg["retrieved"] = True
-
-            response = f"RETRIEVE|{to_user}|{from_user}|{len(unretrieved_messages)}|{'|'.join(unretrieved_messages)}"
-            self.send_with_ack(response, address)
-            self.save_data()
+            from_user, to_user = fields
+
+            # Both statements are served by the partial messages_unread index.
+            # No more rows than could ever fit in one response are read
+            rows = self.db.execute(
+                "SELECT id, content FROM messages "
+                "WHERE from_user = ? AND to_user = ? AND retrieved = 0 "
+                "ORDER BY id LIMIT ?",
+                (from_user, to_user,
+                 framing.MAX_RESPONSE // framing.FIELD_LENGTH.size)
+            ).fetchall()
+
+            # Send only what fits in one bounded response, but always at
+            # least one message, and mark just those retrieved; the rest
+            # wait for the next RETRIEVE. The count placeholder is at least
+            # as wide as the real count
+            header = [to_user, from_user, str(len(rows))]
+            fitting = framing.fitting_fields(
+                header + [content for _, content in rows],
+                len(header) + 1) - len(header)
+            sent = rows[:max(fitting, 0)]
+            if sent:
+                self.db.execute(
+                    "UPDATE messages SET retrieved = 1 "
+                    "WHERE from_user = ? AND to_user = ? AND retrieved = 0 "
+                    "AND id <= ?",
+                    (from_user, to_user, sent[-1][0]))
+            return framing.RETRIEVE, [to_user, from_user, str(len(sent)),
+                                      *(content for _, content in sent)]
 
         except Exception as e:
-            logging.error(f"Error handling retrieve: {str(e)}")
-            self.send_with_ack("ERROR|Failed to retrieve messages", address)
+            logger.error(f"Error handling retrieve: {str(e)}")
+            return framing.ERROR, ["Failed to retrieve messages"]
 
     def run(self) -> None:
         """Main server loop"""
         self.initialize_socket()
         self.load_data()
 
-        logging.info("Server is ready to receive messages")
+        logger.info("Server is ready to receive messages")
+
+        # One slot per possible opcode byte, so dispatch is a plain index
+        # with no bounds check
+        handlers = [None] * 256
+        handlers[framing.CONNECT] = self.handle_connect
+        handlers[framing.LIST] = self.handle_list
+        handlers[framing.SEND] = self.handle_send
+        handlers[framing.RETRIEVE] = self.handle_retrieve
+
+        # Hoisted out of the loop
+        select = self.selector.select
+        receive_batch = self.receive_batch
+        send_response = self.send_response
+        replay_cache = self.replay_cache
+        sock = self.socket
 
         while True:
             try:
-                if self.socket:
-                    message, client_address = self.socket.recvfrom(
-                        self.buffer_size)
-                    message = message.decode(self.ENCODING)
-
-                    # Send immediate acknowledgment
-                    self.socket.sendto("ACK".encode(
-                        self.ENCODING), client_address)
-
-                    command = message.split("|")[0].strip()
-
-                    handlers = {
-                        "CONNECT": self.handle_connect,
-                        "LIST": self.handle_list,
-                        "SEND": self.handle_send,
-                        "RETRIEVE": self.handle_retrieve
-                    }
-
-                    if command in handlers:
-                        handlers[command](message, client_address)
-                    else:
-                        logging.warning(f"Unknown command received: {command}")
-                        self.send_with_ack(
-                            "ERROR|Unknown command", client_address)
-
-            except timeout:
-                continue
+                # Sleep in the selector until the socket is readable, then
+                # drain everything queued before selecting again
+                for _ in select():
+                    # One timestamp for the whole batch; handlers only need
+                    # it for last_seen and message times
+                    now = datetime.now().isoformat()
+                    for data, client_address in receive_batch():
+                        # A failure only costs this datagram, not the rest of
+                        # the batch already read off the socket
+                        try:
+                            try:
+                                seq, opcode, _, _ = framing.unpack_header(data)
+                            except ValueError as e:
+                                logger.warning(
+                                    f"Dropping malformed datagram from {client_address}: {str(e)}")
+                                continue
+
+                            # Retransmitted request: replay the stored response
+                            # instead of running the handler a second time
+                            cached = replay_cache.get((client_address, seq))
+                            if cached is not None:
+                                for datagram in cached:
+                                    sock.sendto(datagram, client_address)
+                                continue
+
+                            handler = handlers[opcode]
+                            if handler is None:
+                                logger.warning(
+                                    f"Unknown command received: {opcode}")
+                                response = framing.ERROR, ["Unknown command"]
+                            else:
+                                # Fields are only decoded once the request is
+                                # known to be new and to have a handler
+                                try:
+                                    fields = framing.unpack_fields(data)
+                                except ValueError as e:
+                                    # The header carried a seq, so reject the
+                                    # request rather than let the client retry
+                                    logger.warning(
+                                        f"Rejecting malformed request from {client_address}: {str(e)}")
+                                    response = framing.ERROR, ["Malformed request"]
+                                else:
+                                    response = handler(fields, client_address, now)
+                            send_response(response, seq, client_address)
+                        except Exception as e:
+                            logger.error(
+                                f"Error handling datagram from {client_address}: {str(e)}")
+
             except Exception as e:
-                logging.error(f"Error in main loop: {str(e)}")
+                logger.error(f"Error in main loop: {str(e)}")
 
 
 if __name__ == "__main__":